@@ -12,6 +12,7 @@ plugins.
 # ==============================================================================
 # Imports
 import logging
+import inspect
 from collections import namedtuple
 
 # import Polygon
@@ -47,30 +48,50 @@ class NoInputDriverCompatibleError(Exception):
 
 class SelfIntersectingPolygonError(Exception):
     def __init__(self, polygon):
-        super(BadPolygon, self).__init__("Polygon is self-intersecting, and this is not supported.")
+        super(SelfIntersectingPolygonError, self).__init__("Polygon is self-intersecting, and this is not supported.")
 
 
 
-def loadWithAnyDriver(filename, input_drivers):
+def _acceptsTypeWhitelist(load_function):
+    """
+    Test if a driver `load` function accepts the optional `type_whitelist` parameter.
+    """
+    try:
+        (args, _varargs, keywords, _defaults) = inspect.getargspec(load_function)
+    except TypeError: # not a Python function
+        return False
+    return "type_whitelist" in args or keywords is not None
+
+
+def loadWithAnyDriver(filename, input_drivers, type_whitelist=None):
     """
     Try to load an input file with any of the InputDriver child classes provided.
     Classes are tested sequentially and only the first compatible one is used.
+    If `type_whitelist` is not None, only annotations with a type it contains are loaded.
+    Drivers which do not support the `type_whitelist` parameter are filtered after loading.
 
     @raise NoInputDriverCompatibleError if no InputDriver is compatible.
     """
     input_data = None
     for driver_cls in input_drivers:
         try:
-            logger.debug("Trying to open and load '%s' with driver '%s'." % (filename, driver_cls))
+            logger.debug("Trying to open and load '%s' with driver '%s'.", filename, driver_cls)
             driver = driver_cls()
-            input_data = driver.load(filename)
+            if type_whitelist is None:
+                input_data = driver.load(filename)
+            elif _acceptsTypeWhitelist(driver.load):
+                input_data = driver.load(filename, type_whitelist=type_whitelist)
+            else:
+                input_data = [annot for annot in driver.load(filename) if annot.type in type_whitelist]
             break;
         except UnsupportedFile:
-            logger.debug("Cannot read '%s' with driver '%s'." %(filename, driver))
+            logger.debug("Cannot read '%s' with driver '%s'.", filename, driver)
             logger.debug("\t Trying next driver, if available...")
     if input_data is None:
         raise NoInputDriverCompatibleError(filename)
-    return input_data
+    # Drivers may not provide bounding boxes
+    return [annot if annot.bbox is not None else annot._replace(bbox=annot.shape.boundingBox())
+            for annot in input_data]
 
 
     """
@@ -83,8 +104,12 @@ def loadWithAnyDriver(filename, input_drivers):
     - a type indicator (string) ;
     - a set of (attribute -> value) elements (= dict).
 
+    The bounding box (xmin, xmax, ymin, ymax) of the shape is cached with it.
+    It is optional for drivers: `loadWithAnyDriver` computes it when it is None.
+
     """
-SegmentationAnnotation = namedtuple("SegmentationAnnotation", ["shape", "type", "attributes"])
+SegmentationAnnotation = namedtuple("SegmentationAnnotation", ["shape", "type", "attributes", "bbox"])
+SegmentationAnnotation.__new__.__defaults__ = (None,)
 
 
 
@@ -94,9 +119,11 @@ class InputDriver(object):
     """
 
     @staticmethod
-    def load(filename):
+    def load(filename, type_whitelist=None):
         """
         Load a file indicated by `filename` and return a sequence of segmentation annotations.
+        If `type_whitelist` is not None, annotations with a type it does not contain
+        must be skipped, ideally before building their shape.
 
         Childs' implementation must raise `UnsupportedFile` here if the file is
         not supported.
@@ -53,13 +53,16 @@ import logging
 import argparse
 import sys
 import csv
+import multiprocessing
 import numpy as np
+import scipy.sparse
 
 # ==============================================================================
 # Project imports
 from utils.args import *
 from utils.log import *
 from drivers.InputDriver import *
+from utils.polygon import rasterIntersectionArea, pointsInside, isAxisAlignedRectangle
 
 # Temporary imports
 import plugin_numis.lifInputDriver
@@ -82,6 +85,25 @@ PROG_NAME_SHORT = "eval_geom"
 E_OK = 0
 E_NOFILE = 10
 
+# Intersection area computation methods
+METHOD_EXACT = "exact"
+METHOD_RASTER = "raster"
+METHOD_MONTECARLO = "montecarlo"
+METHODS = [METHOD_EXACT, METHOD_RASTER, METHOD_MONTECARLO]
+# Minimum number of vertices of both polygons to use rasterization with METHOD_RASTER,
+# and maximum area (in pixels) of the rasterized window per vertex: below the first one,
+# or above the second one, exact polygon clipping is faster (measured crossovers)
+RASTER_MIN_VERTICES = 2048
+RASTER_MAX_PIXELS_PER_VERTEX = 100
+# Minimum bounding box area (in pixels) of both shapes to use rasterization with METHOD_RASTER:
+# rasterization error is relatively large for small shapes
+RASTER_MIN_AREA = 32 * 32
+# Number of points sampled in the bounding box of each reference shape with METHOD_MONTECARLO
+MONTECARLO_SAMPLES = 10000
+# Minimum number of vertices of both polygons to use sampling with METHOD_MONTECARLO:
+# below it, exact polygon clipping is faster (measured crossover)
+MONTECARLO_MIN_VERTICES = 5120
+
 
 # ==============================================================================
 # SHAPE MATCHING FUNCTIONS
@@ -89,184 +111,250 @@ E_NOFILE = 10
 # For matrices:
 # - row correspond to reference elements
 # - columns correspond to test elements
+# Weight and link matrices are sparse (CSR) as most element pairs do not overlap.
     
-def compute_weight_mat(ref_data_vect, test_data_vect):
-    weight_mat = np.empty((len(ref_data_vect), len(test_data_vect)), dtype=np.float)
+def compute_bbox_mat(data_vect):
+    """
+    Return a (N, 4) array containing the bounding box (xmin, xmax, ymin, ymax)
+    of each annotation shape.
+    """
+    return np.array([annot.bbox for annot in data_vect], dtype=np.float).reshape((-1, 4))
+
+def compute_candidate_pairs(ref_bbox_mat, test_bbox_mat):
+    """
+    Return (rows, cols), the indices of reference and test elements which bounding boxes
+    overlap, sorted by reference index.
+    Test boxes are sorted along the x axis so each reference box is only compared to
+    the test boxes which may overlap it, without building a N*M overlap matrix.
+    """
+    (tx0, tx1, ty0, ty1) = test_bbox_mat.T
+    order = np.argsort(tx0, kind='mergesort')
+    sorted_tx0 = tx0[order]
+    max_width = (tx1 - tx0).max() if len(order) > 0 else 0.
+    rows = [np.zeros(0, dtype=np.intp)]
+    cols = [np.zeros(0, dtype=np.intp)]
+    for (i, (rx0, rx1, ry0, ry1)) in enumerate(ref_bbox_mat):
+        # test boxes starting between (rx0 - max_width) and rx1 may overlap along x
+        start = np.searchsorted(sorted_tx0, rx0 - max_width, side='left')
+        stop = np.searchsorted(sorted_tx0, rx1, side='right')
+        candidates = order[start:stop]
+        candidates = candidates[(rx0 <= tx1[candidates]) & (ry0 <= ty1[candidates]) & (ty0[candidates] <= ry1)]
+        rows.append(np.full(len(candidates), i, dtype=np.intp))
+        cols.append(np.sort(candidates))
+    return (np.concatenate(rows), np.concatenate(cols))
+
+def compute_rectangle_vect(data_vect):
+    """
+    Return a (N,) boolean array indicating which annotation shapes are axis-aligned rectangles.
+    """
+    return np.fromiter((isAxisAlignedRectangle(annot.shape) for annot in data_vect), dtype=np.bool, count=len(data_vect))
+
+def compute_area_vect(data_vect):
+    """
+    Return a (N,) array containing the area of each annotation shape.
+    """
+    return np.fromiter((annot.shape.area() for annot in data_vect), dtype=np.float32, count=len(data_vect))
+
+def _bbox_area(shape):
+    (xmin, xmax, ymin, ymax) = shape.boundingBox()
+    return (xmax - xmin) * (ymax - ymin)
+
+def _bbox_intersection_area(shape1, shape2):
+    (xmin1, xmax1, ymin1, ymax1) = shape1.boundingBox()
+    (xmin2, xmax2, ymin2, ymax2) = shape2.boundingBox()
+    return max(0., min(xmax1, xmax2) - max(xmin1, xmin2)) * max(0., min(ymax1, ymax2) - max(ymin1, ymin2))
+
+def compute_intersection_area(ref_shape, test_shape, method=METHOD_EXACT):
+    """
+    Compute the area of the intersection of two shapes.
+    With METHOD_RASTER, intersection of polygons having many vertices over a small
+    enough window is approximated using rasterization, which is faster than exact
+    polygon clipping in this case only, unless one of the shapes is too small for the
+    approximation to be accurate.
+    """
+    vertex_count = ref_shape.nPoints() + test_shape.nPoints()
+    if (method == METHOD_RASTER
+            and vertex_count >= RASTER_MIN_VERTICES
+            and _bbox_intersection_area(ref_shape, test_shape) <= RASTER_MAX_PIXELS_PER_VERTEX * vertex_count
+            and min(_bbox_area(ref_shape), _bbox_area(test_shape)) >= RASTER_MIN_AREA):
+        return rasterIntersectionArea(ref_shape, test_shape)
+    return (ref_shape & test_shape).area()
+
+def compute_rectangle_weights(ref_bbox_mat, test_bbox_mat, rows, cols):
+    """
+    Compute the area of intersection of each (rows[k], cols[k]) pair of axis-aligned
+    rectangles, given their bounding boxes.
+    """
+    (rx0, rx1, ry0, ry1) = ref_bbox_mat[rows].T
+    (tx0, tx1, ty0, ty1) = test_bbox_mat[cols].T
+    inter_w = np.maximum(0., np.minimum(rx1, tx1) - np.maximum(rx0, tx0))
+    inter_h = np.maximum(0., np.minimum(ry1, ty1) - np.maximum(ry0, ty0))
+    return (inter_w * inter_h).astype(np.float32)
+
+def compute_montecarlo_weights(ref_shapes, test_shapes, rows, cols, n_samples=MONTECARLO_SAMPLES):
+    """
+    Approximate the area of intersection of each (rows[k], cols[k]) pair of shapes
+    by counting how many points, sampled uniformly inside the reference shape, fall
+    inside the test shape.
+    Points are sampled only once for each reference shape, and the random seed
+    depends only on the reference index to make results reproducible.
+    Pairs of polygons with less than MONTECARLO_MIN_VERTICES vertices in total are
+    computed exactly, as polygon clipping is faster than sampling for them.
+    """
+    weights = np.zeros(len(rows), dtype=np.float32)
+    sampled_ref = None
+    for (k, (i, j)) in enumerate(zip(rows, cols)):
+        if ref_shapes[i].nPoints() + test_shapes[j].nPoints() < MONTECARLO_MIN_VERTICES:
+            weights[k] = (ref_shapes[i] & test_shapes[j]).area()
+            continue
+        if i != sampled_ref:
+            # rows are sorted: new reference shape
+            (xmin, xmax, ymin, ymax) = ref_shapes[i].boundingBox()
+            random_state = np.random.RandomState(i)
+            samples = random_state.uniform((xmin, ymin), (xmax, ymax), (n_samples, 2)).astype(np.float32)
+            # Sorting samples by y speeds up pointsInside, and filtering keeps them sorted
+            samples = samples[np.argsort(samples[:,1], kind='mergesort')]
+            samples = samples[pointsInside(ref_shapes[i], samples)]
+            sample_area = (xmax - xmin) * (ymax - ymin) / n_samples
+            sampled_ref = i
+        (txmin, txmax, tymin, tymax) = test_shapes[j].boundingBox()
+        candidates = samples[(samples[:,0] >= txmin) & (samples[:,0] <= txmax)
+                           & (samples[:,1] >= tymin) & (samples[:,1] <= tymax)]
+        weights[k] = pointsInside(test_shapes[j], candidates).sum() * sample_area
+    return weights
+
+def compute_weights(ref_shapes, test_shapes, rows, cols, method=METHOD_EXACT):
+    """
+    Compute the area of intersection of each (rows[k], cols[k]) pair of shapes.
+    """
+    # FIXME check self intersection of every polygon
+    if method == METHOD_MONTECARLO:
+        return compute_montecarlo_weights(ref_shapes, test_shapes, rows, cols)
+    return np.fromiter((compute_intersection_area(ref_shapes[i], test_shapes[j], method) for (i, j) in zip(rows, cols)),
+                       dtype=np.float32, count=len(rows))
+
+# Shapes shared with worker processes, see compute_weight_mat()
+_worker_shapes = None
+
+def _init_weights_worker(ref_shapes, test_shapes):
+    global _worker_shapes
+    _worker_shapes = (ref_shapes, test_shapes)
+
+def _weights_worker(task):
+    (rows, cols, method) = task
+    (ref_shapes, test_shapes) = _worker_shapes
+    return compute_weights(ref_shapes, test_shapes, rows, cols, method)
+
+def compute_weight_mat(ref_data_vect, test_data_vect, method=METHOD_EXACT, jobs=1):
+    # Bounding box pre-filter: shapes with disjoint bounding boxes cannot intersect,
+    # so we only compute (expensive) polygon intersection for the remaining pairs.
+    ref_bbox_mat = compute_bbox_mat(ref_data_vect)
+    test_bbox_mat = compute_bbox_mat(test_data_vect)
+    (rows, cols) = compute_candidate_pairs(ref_bbox_mat, test_bbox_mat)
     #calculate weight, p
-    for i in range(len(ref_data_vect)):
-        for j in range(len(test_data_vect)):
-            inter = ref_data_vect[i].shape & test_data_vect[j].shape
-            # FIXME check self intersection of every polygon
-            weight_mat[i,j] = inter.area() 
+    weights = np.empty(len(rows), dtype=np.float32)
+    # Intersection between axis-aligned rectangles is directly computed from their bounding boxes
+    rect_pairs = compute_rectangle_vect(ref_data_vect)[rows] & compute_rectangle_vect(test_data_vect)[cols]
+    weights[rect_pairs] = compute_rectangle_weights(ref_bbox_mat, test_bbox_mat, rows[rect_pairs], cols[rect_pairs])
+    # Other pairs need polygon intersection
+    (poly_rows, poly_cols) = (rows[~rect_pairs], cols[~rect_pairs])
+    ref_shapes = [annot.shape for annot in ref_data_vect]
+    test_shapes = [annot.shape for annot in test_data_vect]
+    if jobs > 1 and len(poly_rows) > 0:
+        # Pairs are independent: split them in a few chunks per process to balance the load
+        chunk_count = jobs * 4
+        tasks = [(chunk_rows, chunk_cols, method)
+                 for (chunk_rows, chunk_cols) in zip(np.array_split(poly_rows, chunk_count), np.array_split(poly_cols, chunk_count))]
+        pool = multiprocessing.Pool(jobs, _init_weights_worker, (ref_shapes, test_shapes))
+        try:
+            weights[~rect_pairs] = np.concatenate(pool.map(_weights_worker, tasks))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        weights[~rect_pairs] = compute_weights(ref_shapes, test_shapes, poly_rows, poly_cols, method)
+    weight_mat = scipy.sparse.coo_matrix((weights, (rows, cols)),
+                                         shape=(len(ref_data_vect), len(test_data_vect))).tocsr()
+    # Touching bounding boxes lead to null intersections
+    weight_mat.eliminate_zeros()
     return weight_mat
 
 def compute_ref_margin_vect(weight_mat):
-    reflen, _testlen = weight_mat.shape
-    ref_margin_vect = np.empty(reflen, dtype=np.float)
-    for i in range(reflen):
-        ref_margin_vect[i] = weight_mat[i,:].sum()
-    return ref_margin_vect
+    return weight_mat.sum(axis=1).A1
 
 def compute_test_margin_vect(weight_mat) :
-    _reflen, testlen = weight_mat.shape
-    test_margin_vect = np.empty(testlen, dtype=np.float)
-    for j in range(testlen):
-        test_margin_vect[j] = weight_mat[:,j].sum()
-    return test_margin_vect
+    return weight_mat.sum(axis=0).A1
 
 
 # FIXME parameters
 thresholdRelative = 0.2
 threshold_ref = 0.5
 threshold_test = 0.5
-def compute_link_mat(weight_mat, ref_margin_vect, test_margin_vect, ref_data_vect, test_data_vect):
+def compute_link_mat(weight_mat, ref_margin_vect, test_margin_vect, ref_area_vect, test_area_vect):
     # Check lengths compatibility
     reflen, testlen = weight_mat.shape
-    assert reflen == len(ref_margin_vect) == len(ref_data_vect), \
-           "Reference vectors have different lenghts: w:%d m:%d d:%d" % (reflen, len(ref_margin_vect), len(ref_data_vect))
-    assert testlen == len(test_margin_vect) == len(test_data_vect), \
-           "Test vectors have different lenghts: w:%d m:%d d:%d" % (testlen, len(test_margin_vect), len(test_data_vect))
+    assert reflen == len(ref_margin_vect) == len(ref_area_vect), \
+           "Reference vectors have different lenghts: w:%d m:%d a:%d" % (reflen, len(ref_margin_vect), len(ref_area_vect))
+    assert testlen == len(test_margin_vect) == len(test_area_vect), \
+           "Test vectors have different lenghts: w:%d m:%d a:%d" % (testlen, len(test_margin_vect), len(test_area_vect))
 
-    link_mat = np.empty((len(ref_data_vect), len(test_data_vect)), dtype=np.bool)
     #matching
-    for i in range(len(ref_margin_vect)):
-        for j in range(len(test_margin_vect)):
-            significant = False
-            # note: this is not explicit in the papers, but when weight_mat[i,:] != 0 <=> ref_margin_vect[i] != 0
-            #       (same for j)
-            #       and there is obviously no link when weight_mat[i,j] == 0
-            if weight_mat[i,j] > 0:
-                if (weight_mat[i,j]/ref_margin_vect[i]) >= thresholdRelative:
-                    if (weight_mat[i,j])/(ref_data_vect[i].shape.area()) > threshold_ref:
-                        significant = True
-                elif (weight_mat[i,j]/test_margin_vect[j]) >= thresholdRelative:
-                    if (weight_mat[i,j])/(test_data_vect[j].shape.area()) > threshold_test:
-                        significant = True
-            link_mat[i,j] = significant
+    # note: this is not explicit in the papers, but when weight_mat[i,:] != 0 <=> ref_margin_vect[i] != 0
+    #       (same for j)
+    #       and there is obviously no link when weight_mat[i,j] == 0
+    #       so we only consider stored (non zero) values of the weight matrix.
+    weight_coo = weight_mat.tocoo()
+    (rows, cols, weights) = (weight_coo.row, weight_coo.col, weight_coo.data)
+    positive = weights > 0
+    ref_relative = (weights / ref_margin_vect[rows]) >= thresholdRelative
+    test_relative = (weights / test_margin_vect[cols]) >= thresholdRelative
+    ref_significant = (weights / ref_area_vect[rows]) > threshold_ref
+    test_significant = (weights / test_area_vect[cols]) > threshold_test
+    # test side is considered only if the reference side is not relevant
+    significant = positive & ((ref_relative & ref_significant)
+                            | (~ref_relative & test_relative & test_significant))
+    link_mat = scipy.sparse.coo_matrix((np.ones(significant.sum(), dtype=np.bool), (rows[significant], cols[significant])),
+                                       shape=(reflen, testlen)).tocsr()
     return link_mat
 
 
 # ==============================================================================
 # ERROR TYPE CLASSIFICATION FUNCTIONS
 
-# TODO is it possible to factorize the functions (and keep them simple)?
-
-def find_total_correct_segmentation(link_mat):
+def compute_stats(link_mat):
     """
-    Detect 1 to 1 matches (actually correct "detections", which could be better evaluated with prec. & rec. later)
+    Compute correct, over- / under- segmentation, missed and false alarm statistics
+    from the link matrix, using a single pass for row and column link counts.
+
+    @return (Tc, To, Tu, Co, Cu, Cm, Cf) where:
+    - Tc is the total correct segmentation: number of 1 to 1 matches (actually
+      correct "detections", which could be better evaluated with prec. & rec. later);
+    - To is the total over segmentation: number of extra test elements matched
+      by reference elements which are linked to more than one test element;
+    - Tu is the total under segmentation: number of extra reference elements matched
+      by test elements which are linked to more than one reference element;
+    - Co is the number of over segmented reference elements;
+    - Cu is the number of under segmented test elements;
+    - Cm is the number of missed reference elements (no link);
+    - Cf is the number of false alarm test elements (no link).
     """
-    # FIXME algo could be faster: filter for each line 1-to-1 match and retain (col,row) index, then control in 1 pass (iterate over retained col idx)
-    reflen, testlen = link_mat.shape
-    total_correct_segmentation = 0 
-    for i in range(reflen):
-        row_match_count = 0
-        col_match_count = 0 
-        row_match_index = 0
-        # find in test elts matching with current ref elt
-        for j in range(testlen):
-            if link_mat[i,j]:
-                row_match_count += 1
-                row_match_index = j
-        if row_match_count == 1:
-            # only 1 matching in test, is it reciprocal?
-            # FIXME extra complexity here
-            for ii in range(reflen):
-                if link_mat[ii][row_match_index]:
-                    col_match_count += 1
-            if col_match_count == 1:
-                total_correct_segmentation += 1
-    return total_correct_segmentation
-
-def find_total_over_segmentation(link_mat):
-    """ TODO DOC"""
-    reflen, testlen = link_mat.shape
-    number_significant_refc = 0
-    number_refc_at_least_one_edge = 0
-    total_over_segmentation = 0 
-    
-    for i in range(reflen):
-        match_flag = 0
-        for j in range(testlen):
-            if link_mat[i,j]:
-                match_flag += 1
-        if match_flag > 1:
-            number_refc_at_least_one_edge += match_flag
-            number_significant_refc += 1
-    total_over_segmentation = number_refc_at_least_one_edge - number_significant_refc
-    return total_over_segmentation
-
-def find_total_under_segmentation(link_mat):
-    """ TODO DOC"""
-    reflen, testlen = link_mat.shape
-    number_significant_testc = 0
-    number_testc_at_least_one_edge = 0
-    total_under_segmentation = 0 
-    
-    for j in range(testlen):
-        match_flag = 0
-        for i in range(reflen):
-            if link_mat[i,j]:
-                match_flag += 1
-        if match_flag > 1:
-            number_testc_at_least_one_edge += match_flag
-            number_significant_testc += 1
-    total_under_segmentation = number_testc_at_least_one_edge - number_significant_testc
-    return total_under_segmentation
-
-# FIXME merge with find_total_over_segmentation: will be simpler to understand the difference
-def find_num_over_segmentation_components(link_mat):  
-    """ TODO DOC"""
-    reflen, testlen = link_mat.shape
-    num_over_segmentation_component = 0
-    for i in range(reflen):
-        match_flag = 0
-        for j in range(testlen):
-            if link_mat[i,j]:
-                match_flag += 1
-        if match_flag > 1:
-            num_over_segmentation_component += 1
-    return num_over_segmentation_component
-
-def find_num_under_segmentation_components(link_mat): 
-    """ TODO DOC"""
-    reflen, testlen = link_mat.shape
-    num_under_segmentation_component = 0
-    for j in range(testlen):
-        match_flag = 0
-        for i in range(reflen):
-            if link_mat[i,j]:
-                match_flag += 1
-        if match_flag > 1:
-            num_under_segmentation_component += 1
-    return num_under_segmentation_component
-
-def find_num_missed_components(link_mat): 
-    """ TODO DOC"""
-    reflen, testlen = link_mat.shape
-    num_missed_components = 0
-    for i in range(reflen):
-        match_flag = 0
-        for j in range(testlen):
-            if link_mat[i,j]:
-                match_flag += 1
-                break
-        if match_flag == 0:
-            num_missed_components += 1
-    return num_missed_components
-
-def find_num_false_alarm_components(link_mat):    
-    """ TODO DOC"""
-    reflen, testlen = link_mat.shape
-    num_false_alarm_components = 0
-    for j in range(testlen):
-        match_flag = 0
-        for i in range(reflen):
-            if link_mat[i,j]:
-                match_flag += 1
-                break
-        if match_flag == 0:
-            num_false_alarm_components += 1
-    return num_false_alarm_components
+    row_match_count = link_mat.sum(axis=1).A1
+    col_match_count = link_mat.sum(axis=0).A1
+    # only 1 matching in test for a ref elt: is it reciprocal?
+    (_rows, row_match_index) = link_mat[row_match_count == 1].nonzero()
+    total_correct_segmentation = int((col_match_count[row_match_index] == 1).sum())
+    row_over = row_match_count > 1
+    col_under = col_match_count > 1
+    total_over_segmentation = int(row_match_count[row_over].sum() - row_over.sum())
+    total_under_segmentation = int(col_match_count[col_under].sum() - col_under.sum())
+    num_over_segmentation_components = int(row_over.sum())
+    num_under_segmentation_components = int(col_under.sum())
+    num_missed_components = int((row_match_count == 0).sum())
+    num_false_alarm_components = int((col_match_count == 0).sum())
+    return (total_correct_segmentation,
+            total_over_segmentation, total_under_segmentation,
+            num_over_segmentation_components, num_under_segmentation_components,
+            num_missed_components, num_false_alarm_components)
 
 
 
@@ -300,10 +388,27 @@ def main():
     parser.add_argument('-o', '--output-file',
         help="Optional path to CSV output file.")
 
+    parser.add_argument('-m', '--method',
+        choices=METHODS,
+        default=METHOD_EXACT,
+        help="Method used to compute the area of intersection between shapes. " +
+             "'%s' approximates it using rasterization when it is faster than exact clipping, " % METHOD_RASTER +
+             "for pairs of polygons with at least %d vertices in total " % RASTER_MIN_VERTICES +
+             "and at most %d pixels per vertex in the intersection of their bounding boxes, " % RASTER_MAX_PIXELS_PER_VERTEX +
+             "when both shapes have a bounding box of at least %d pixels " % RASTER_MIN_AREA +
+             "(error is unbiased and typically within 1%% of the intersection area). " +
+             "'%s' approximates it using %d points sampled in each reference shape bounding box " % (METHOD_MONTECARLO, MONTECARLO_SAMPLES) +
+             "when it is faster than exact clipping, for pairs of polygons with at least %d vertices in total." % MONTECARLO_MIN_VERTICES)
+
+    parser.add_argument('-j', '--jobs',
+        action=StoreIntZeroPositive,
+        default=1,
+        help="Number of processes used to compute intersection areas. " +
+             "0 means one process per available CPU.")
+
     # TODO option to select plugins (multiple) to use
     # now: load everything / hardcoded elements
 
-    # TODO option to select method to use 
     args = parser.parse_args()
 
     # -----------------------------------------------------------------------------
@@ -324,42 +429,38 @@ def main():
     available_input_drivers = [plugin_numis.lifInputDriver.lifInputDriver, 
                                plugin_numis.catinfoXMLInputDriver.catinfoXMLInputDriver]
     
-    ref_input_vect = loadWithAnyDriver(args.reference, available_input_drivers)
-    test_input_vect = loadWithAnyDriver(args.test, available_input_drivers)
+    # Filter components based on label if needed, while loading
+    type_whitelist = None
+    if args.type_restriction:
+        type_whitelist = set(args.type_restriction)
+    ref_data_vect = loadWithAnyDriver(args.reference, available_input_drivers, type_whitelist)
+    test_data_vect = loadWithAnyDriver(args.test, available_input_drivers, type_whitelist)
+    # Note: `ref_data_vect` and `test_data_vect` can be empty.
 
     # --------------------------------------------------------------------------
     logger.debug("--- Process started. ---")
     # TODO Extract function
 
-    # Filter components based on label if needed
-    ref_data_vect  = ref_input_vect
-    test_data_vect = test_input_vect
-    if args.type_restriction:
-        ref_data_vect  = [annot for annot in ref_input_vect  if annot.type in args.type_restriction]
-        test_data_vect = [annot for annot in test_input_vect if annot.type in args.type_restriction]
-    # Note: `ref_data_vect` and `test_data_vect` can be empty.
-
     logger.debug("Compute weighting matrix.")
-    weight_mat = compute_weight_mat(ref_data_vect, test_data_vect)
+    jobs = args.jobs or multiprocessing.cpu_count()
+    weight_mat = compute_weight_mat(ref_data_vect, test_data_vect, args.method, jobs)
     
     logger.debug("Compute marginal values.")
     ref_margin_vect = compute_ref_margin_vect(weight_mat)
     test_margin_vect = compute_test_margin_vect(weight_mat)
 
+    logger.debug("Compute areas.")
+    ref_area_vect = compute_area_vect(ref_data_vect)
+    test_area_vect = compute_area_vect(test_data_vect)
+
     logger.debug("Compute link matrix.")
-    link_mat = compute_link_mat(weight_mat, ref_margin_vect, test_margin_vect, ref_data_vect, test_data_vect)
+    link_mat = compute_link_mat(weight_mat, ref_margin_vect, test_margin_vect, ref_area_vect, test_area_vect)
 
     # print link_mat # DBG
 
     logger.debug("Compute statistics.")
     # TODO "find(_num)" -> "count"?
-    Tc = find_total_correct_segmentation(link_mat)
-    To = find_total_over_segmentation(link_mat)
-    Tu = find_total_under_segmentation(link_mat)
-    Co = find_num_over_segmentation_components(link_mat)
-    Cu = find_num_under_segmentation_components(link_mat)
-    Cm = find_num_missed_components(link_mat)
-    Cf = find_num_false_alarm_components(link_mat)
+    (Tc, To, Tu, Co, Cu, Cm, Cf) = compute_stats(link_mat)
     # --
     Cr, Ct = link_mat.shape # Total components considered in reference and test
 
@@ -386,14 +487,13 @@ def main():
     # Output to file if requested
     # TODO Extract function
     if args.output_file:
-        logger.debug("Exporting results to file '%s'." % args.output_file)
+        logger.debug("Exporting results to file '%s'.", args.output_file)
         with open(args.output_file, "wb") as ofile:
             csv_writer = csv.writer(ofile, delimiter='\t', quotechar='"', quoting=csv.QUOTE_NONNUMERIC)
-            # Output header
+            # Output header and results at once
             header = ["RefFile", "TestFile", "Tc", "To", "Tu", "Co", "Cu", "Cm", "Cf", "Cr", "Ct"]
-            csv_writer.writerow(header)
             res = [args.reference, args.test, Tc, To, Tu, Co, Cu, Cm, Cf, Cr, Ct]
-            csv_writer.writerow(res)
+            csv_writer.writerows([header, res])
         logger.debug("Done exporting results to file.")
 
 
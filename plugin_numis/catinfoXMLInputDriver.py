@@ -21,16 +21,15 @@ InputDriver child class for cat_info.xml files.
 # Imports
 import logging
 import os.path
-import xml.sax
+import xml.etree.cElementTree as ElementTree
 
 import Polygon
 import Polygon.Utils
 
 # ==============================================================================
 # Project imports
-from drivers.InputDriver import UnsupportedFile, SegmentationAnnotation, InputDriver, SelfIntersectingPolygonError
+from drivers.InputDriver import UnsupportedFile, SegmentationAnnotation, InputDriver
 from utils.log import createAndInitLogger
-from utils.polygon import isSelfIntersecting
 
 # ==============================================================================
 # Logger configuration
@@ -39,6 +38,9 @@ logger = createAndInitLogger(__name__) #, debug=True)
 
 # ==============================================================================
 known_tags =  tag_coins, tag_coin, tag_image, tag_label = ['coins', 'coin', 'image', 'label']
+# Type of the annotations produced by tags
+tag_types = {tag_image : 'coin',
+             tag_label : 'label'}
 
 # ==============================================================================
 
@@ -46,119 +48,85 @@ class XMLFileError(Exception):
     pass
 
 
-class _catinfoContentHandler(xml.sax.ContentHandler):
-    def __init__(self):
-        xml.sax.ContentHandler.__init__(self)
-        self.eltStack = []
-        self.annotations = []
-        self.cType = None
-        self.cShape = None
-        self.cAttrib = None
-        self.cAutoId = 0
-        self.insideUnk = None # None = No, int = unknown level
-
-    def _parseShapeAttr(self, attrs):
-        x = float(attrs.getValue('x'))
-        y = float(attrs.getValue('y'))
-        w = float(attrs.getValue('w'))
-        h = float(attrs.getValue('h'))
-        shape = Polygon.Polygon([(x,y), (x,y+h), (x+w,y+h), (x+w, y)])
-        if isSelfIntersecting(shape):
-            raise BadPolygon(shape)
-        self.cShape = shape
-
-    @staticmethod
-    def _parseCoinSide(attrs):
-        face = attrs.getValue("face")
-        f = face[0:min(3,len(face))]
-        if f == 'aver':
-            return "avers"
-        elif f == 'reve':
-            return "revers"
-        else:
-            return "isolated"
-
-    def _autoIdStr(self):
-        return "_autogen_%04d" % self.cAutoId
-
-    def _commitAnnot(self):
-        self.annotations.append(SegmentationAnnotation(self.cShape, self.cType, self.cAttrib))
-        self.cShape = self.cType = self.cAttrib = None
-
-    def startElement(self, name, attrs):
-        logger.debug("startElement '" + name + "'")
-        self.eltStack.append(name)
-
-        # Actual parsing of known tags
-        if name == tag_coins:
-            logger.debug("Beginning parsing document.")
-        elif name == tag_coin:
-            self.cAutoId += 1
-        elif name == tag_label:
-            self.cType = 'label'
-            self._parseShapeAttr(attrs) # TODO try and logger.error + ignore (with insideUnk) if BadPoly?
-            self.cAttrib = {'id' : self._autoIdStr()}
-        elif name == tag_image:
-            self.cType = 'coin'
-            self._parseShapeAttr(attrs) # TODO try and logger.error + ignore (with insideUnk) if BadPoly?
-            self.cAttrib = {'id' : self._autoIdStr(),
-                            'side' : _catinfoContentHandler._parseCoinSide(attrs)}
-        else:
-            logger.debug("Got unknown opening tag '%s'. Will ignore its content." % name)
-            self.insideUnk = len(self.eltStack)
-
-    def endElement(self, name):
-        logger.debug("endElement '" + name + "'")
-        prevElt = None
-        if len(self.eltStack) > 0:
-            prevElt = self.eltStack.pop()
-        else:
-            msg = "Got unexpected element end: '%s'. Expected start of document." % name
-            logger.error(msg)
-            raise XMLFileError(msg)
-
-        if name != prevElt:
-            msg = "Got unexpected element end: '%s'. Expected closing '%s'." % (name, prevElt)
-            logger.error(msg)
-            raise XMLFileError(msg)
-
-        # Actual parsing of known tags
-        if name == tag_coins:
-            logger.debug("Finished parsing document.")
-        elif name == tag_coin:
-            logger.debug("Finished parsing coin info.")
-            # pass
+def _parseShapeAttr(attrib):
+    """
+    Return the rectangle shape described by the attributes of a tag, and its
+    bounding box (xmin, xmax, ymin, ymax).
+    """
+    x = float(attrib['x'])
+    y = float(attrib['y'])
+    w = float(attrib['w'])
+    h = float(attrib['h'])
+    # Note: rectangles built from 4 corners never self-intersect, there is no need to check them
+    shape = Polygon.Polygon([(x,y), (x,y+h), (x+w,y+h), (x+w, y)])
+    bbox = (min(x, x+w), max(x, x+w), min(y, y+h), max(y, y+h))
+    return (shape, bbox)
+
+def _parseCoinSide(attrib):
+    face = attrib["face"]
+    f = face[0:min(3,len(face))]
+    if f == 'aver':
+        return "avers"
+    elif f == 'reve':
+        return "revers"
+    else:
+        return "isolated"
+
+def _autoIdStr(autoId):
+    return "_autogen_%04d" % autoId
+
+def _parseAnnotations(f, type_whitelist=None):
+    """
+    Parse a cat_info.xml file object and return the list of annotations it contains.
+    Content of unknown tags is ignored, as well as annotations which type is not in
+    `type_whitelist` if it is not None.
+    """
+    debug = logger.isEnabledFor(logging.DEBUG)
+    annotations = []
+    cAutoId = 0
+    for (event, elem) in ElementTree.iterparse(f, events=('start', 'end')):
+        name = elem.tag
+        if event == 'start':
+            if name == tag_coin:
+                cAutoId += 1
+            continue
+
+        # Actual parsing of known tags, once they are complete
+        if type_whitelist is not None and tag_types.get(name) not in type_whitelist:
+            pass
         elif name == tag_label:
-            logger.debug("Finished parsing label info: shape=%s" % self.cShape)
-            self._commitAnnot()
+            (shape, bbox) = _parseShapeAttr(elem.attrib)
+            if debug:
+                logger.debug("Finished parsing label info: shape=%s", shape)
+            annotations.append(SegmentationAnnotation(shape, 'label', {'id' : _autoIdStr(cAutoId)}, bbox))
         elif name == tag_image:
-            logger.debug("Finished parsing coin side info: shape=%s; side=%s" % (self.cShape, self.cAttrib['side']))
-            self._commitAnnot()
-        else:
-            logger.debug("Got unknown closing tag '%s'." % name)
-            
-        if self.insideUnk is not None and len(self.eltStack) < self.insideUnk:
-            logger.debug("Finished ignoring content of unknown tag '%s'." % name)
-            self.insideUnk = None
+            (shape, bbox) = _parseShapeAttr(elem.attrib)
+            attributes = {'id' : _autoIdStr(cAutoId),
+                          'side' : _parseCoinSide(elem.attrib)}
+            if debug:
+                logger.debug("Finished parsing coin side info: shape=%s; side=%s", shape, attributes['side'])
+            annotations.append(SegmentationAnnotation(shape, 'coin', attributes, bbox))
+        elif name not in known_tags:
+            if debug:
+                logger.debug("Ignored content of unknown tag '%s'.", name)
+        # Free memory used by parsed elements
+        elem.clear()
 
-    def characters(self, content):
-        logger.debug("Ignoring text content: %d character(s) skipped." % len(content))
+    return annotations
 
 
 class catinfoXMLInputDriver(object):
     suffix = '.xml'
 
     @staticmethod
-    def load(filename):
+    def load(filename, type_whitelist=None):
         if not catinfoXMLInputDriver.isXMLFile(filename):
             raise UnsupportedFile(filename)
 
         annotations = None
         try:
             with open(filename, 'rb') as f:
-                contenthandler = _catinfoContentHandler()
-                xml.sax.parse(f, contenthandler)
-                annotations = contenthandler.annotations
+                annotations = _parseAnnotations(f, type_whitelist)
         except Exception, e:
             raise XMLFileError(e)
 
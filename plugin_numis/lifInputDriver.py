@@ -12,6 +12,8 @@ import logging
 import json
 import os.path
 
+import ijson
+
 import Polygon
 import Polygon.Utils
 
@@ -28,6 +30,10 @@ logger = createAndInitLogger(__name__)
 
 # ==============================================================================
 
+# Files larger than this (in bytes) are parsed incrementally: json.load needs about
+# 6 times the file size in memory, but incremental parsing is about 7 times slower
+STREAM_MIN_FILE_SIZE = 64 * 1024 * 1024
+
 class LabelFileError(Exception):
     pass
 
@@ -93,20 +99,31 @@ class lifInputDriver(object):
 
 
     @staticmethod
-    def load(filename):
+    def load(filename, type_whitelist=None):
         if not lifInputDriver.isLabelFile(filename):
             raise UnsupportedFile(filename)
 
         results = []
         try:
             with open(filename, 'rb') as f:
-                data = json.load(f)
-                for s in data['shapes']:
-                    shape = Polygon.Polygon(s['points'])
+                stream = os.fstat(f.fileno()).st_size >= STREAM_MIN_FILE_SIZE
+                if stream:
+                    # Shapes are parsed one at a time to avoid loading the whole document in memory
+                    shapes = ijson.items(f, 'shapes.item')
+                else:
+                    shapes = json.load(f)['shapes']
+                for s in shapes:
+                    atype, attributes = lifInputDriver.parseLabel(s['label'])
+                    if type_whitelist is not None and atype not in type_whitelist:
+                        continue
+                    points = s['points']
+                    if stream:
+                        # ijson produces Decimal values for non integer numbers
+                        points = [(float(x), float(y)) for (x, y) in points]
+                    shape = Polygon.Polygon(points)
                     if isSelfIntersecting(shape):
                         raise SelfIntersectingPolygonError(shape)
-                    atype, attributes = lifInputDriver.parseLabel(s['label'])
-                    results.append(SegmentationAnnotation(shape, atype, attributes))
+                    results.append(SegmentationAnnotation(shape, atype, attributes, shape.boundingBox()))
 
         except Exception, e:
             raise LabelFileError(e)
@@ -22,14 +22,21 @@ $ find  -iname "*.tif" | \
 import logging
 import argparse
 import sys
+import mmap
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import threading
+import Queue
 import numpy as np
 import cv2
+from PIL import Image
 
 # ==============================================================================
 # Project imports
 from utils.args import *
 from utils.log import *
 from drivers.InputDriver import *
+from utils.polygon import isAxisAlignedRectangle
 
 # Temporary imports
 import plugin_numis.lifInputDriver
@@ -52,21 +59,209 @@ PROG_NAME_SHORT = "segmenter"
 # Error codes
 E_OK = 0
 E_NOFILE = 10
+E_BADIMAGE = 11
+E_WRITEERROR = 12
+
+# ROIs larger than this area (in pixels) are masked without a separate mask buffer
+INPLACE_MASK_MIN_AREA = 4096 * 4096
+
+# EXIF tag of image orientation
+EXIF_ORIENTATION_TAG = 0x0112
+
+# Encoder parameters for output image formats: fast (lossless) PNG compression,
+# and OpenCV's default JPEG quality to keep the fidelity of extracted parts
+ENCODE_PARAMS = {".png"  : [cv2.IMWRITE_PNG_COMPRESSION, 1],
+                 ".jpg"  : [cv2.IMWRITE_JPEG_QUALITY, 95],
+                 ".jpeg" : [cv2.IMWRITE_JPEG_QUALITY, 95]}
 
 # ==============================================================================
 
 # TODO extract to some output driver
+# Filename base generators, for each annotation type
+# Note: noise annotations have no id, output filenames stay unique thanks to the
+# annotation index prefix. Use type restriction to skip noise annotations at load time.
+_filename_base_generators = {
+    'coin'  : lambda attributes: "c%s%s" % (attributes['side'][0], attributes['id']),
+    'label' : lambda attributes: "l%s" % (attributes['id']),
+    'text'  : lambda attributes: "t%s" % (attributes['id']),
+    'noise' : lambda attributes: "n"}
+
 def gen_filename_base(atype, attributes):
-    if atype == 'coin':
-        return "c%s%s" % (attributes['side'][0], attributes['id'])
-    elif atype == 'label':
-        return "l%s" % (attributes['id'])
-    elif atype == 'text':
-        return "t%s" % (attributes['id'])
-    elif atype == 'noise':
-        return "n"
-    else:
+    generator = _filename_base_generators.get(atype)
+    if generator is None:
         raise ValueError("Unknown annotation format: t=%s; attr=%s" % (atype, attributes))
+    return generator(attributes)
+
+
+def read_exif_orientation(filename):
+    """
+    Return the EXIF orientation (1 to 8) of the image `filename`, 1 if it has none.
+    """
+    try:
+        return Image.open(filename).getexif().get(EXIF_ORIENTATION_TAG, 1)
+    except Exception: # unsupported format or invalid EXIF data
+        return 1
+
+
+def apply_exif_orientation(img, orientation):
+    """
+    Transpose and flip `img` according to its EXIF `orientation`, like cv2.imread does.
+    """
+    if orientation in (5, 6, 7, 8):
+        img = img.swapaxes(0, 1)
+    if orientation in (2, 6):
+        img = img[:, ::-1]
+    elif orientation in (3, 7):
+        img = img[::-1, ::-1]
+    elif orientation in (4, 8):
+        img = img[::-1]
+    return np.ascontiguousarray(img)
+
+
+def load_image(filename):
+    """
+    Decode the image `filename` from a read-only memory map of the file, keeping its
+    original depth and channels (gray, color, alpha), and apply its EXIF orientation.
+    Return None if the image cannot be decoded.
+    """
+    with open(filename, 'rb') as img_file:
+        try:
+            mm = mmap.mmap(img_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError: # empty file
+            return None
+    try:
+        # Orientation is ignored by IMREAD_UNCHANGED, it is applied separately
+        img = cv2.imdecode(np.frombuffer(mm, dtype=np.uint8), cv2.IMREAD_UNCHANGED | cv2.IMREAD_IGNORE_ORIENTATION)
+    finally:
+        mm.close()
+    if img is None:
+        return None
+    return apply_exif_orientation(img, read_exif_orientation(filename))
+
+
+# Scratch buffers for masks rasterized with OpenCV, one per thread
+_mask_scratch = threading.local()
+
+def _scratch_mask(width, height):
+    """
+    Return a zeroed (height, width) uint8 mask using the scratch buffer of the current
+    thread, which is grown when needed.
+    """
+    size = width * height
+    buf = getattr(_mask_scratch, 'buf', None)
+    if buf is None or buf.size < size:
+        buf = _mask_scratch.buf = np.empty(size, dtype=np.uint8)
+    msk = buf[:size].reshape((height, width))
+    msk.fill(0)
+    return msk
+
+
+def rasterize_mask(contours, width, height):
+    """
+    Return a (height, width) uint8 mask where pixels inside `contours` are set to 255.
+    The mask may use a scratch buffer of the current thread: it is only valid until
+    the next call from the same thread.
+    """
+    if width * height <= INPLACE_MASK_MIN_AREA:
+        msk = _scratch_mask(width, height)
+    else:
+        # Do not keep huge buffers alive
+        msk = np.zeros((height, width), dtype=np.uint8)
+    cv2.fillPoly(msk, contours, 255)
+    return msk
+
+
+def write_files(write_queue, failed_files):
+    """
+    Write the (filename, content) items received from `write_queue`, until None is received.
+    The names of the files which could not be written are appended to `failed_files`.
+    """
+    while True:
+        item = write_queue.get()
+        if item is None:
+            break
+        (filename, content) = item
+        # Any error is recorded and the queue is still drained: if this thread
+        # stopped, producers would block forever on the bounded queue.
+        try:
+            with open(filename, 'wb') as out_file:
+                out_file.write(content)
+        except Exception, e:
+            logger.error("Could not write output file: %s", e)
+            failed_files.append(filename)
+
+
+def mask_in_place(roi, contours):
+    """
+    Return a copy of `roi` where pixels outside `contours` are set to 0.
+    No separate mask is allocated: contours are rasterized directly in the output
+    image with all bits set, which is then combined with `roi`.
+    Only images with unsigned integer pixels are supported.
+    """
+    masked_roi = np.zeros(roi.shape, dtype=roi.dtype)
+    cv2.fillPoly(masked_roi, contours, (np.iinfo(roi.dtype).max,) * 4)
+    cv2.bitwise_and(masked_roi, roi, dst=masked_roi)
+    return masked_roi
+
+
+def process_annotation(annot_idx, annot, img, output_prefix, img_format_ext, encode_params, write_queue):
+    """
+    Export the segmented image and the mask file of the annotation number `annot_idx`,
+    in files which paths start with `output_prefix`.
+    The bounding box of the annotation must not have a null area.
+    The encoded segmented image and the mask file content are sent to `write_queue`
+    to be written by another thread.
+    Return False if the segmented image could not be encoded, True otherwise.
+    """
+    (shape, atype, attributes, bbox) = annot
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Processing annotation %03d with type %s", annot_idx, atype)
+
+    (xmin, xmax, ymin, ymax) = bbox
+
+    path_base = "%s%03d-%s" % (output_prefix, annot_idx, gen_filename_base(atype, attributes))
+    seg_img_fn = path_base + img_format_ext
+    seg_msk_fn = path_base + ".msk"
+
+    # Strided view on the image, works for single channel, color and color+alpha images
+    roi = img[int(ymin):int(ymax), int(xmin):int(xmax)]
+
+    # Vertices of all contours, shifted to ROI coordinates in a single pass
+    contour_ends = np.cumsum([len(c) for c in shape])[:-1]
+    points = np.vstack([np.asarray(c, dtype=np.float64) for c in shape])
+    points -= (xmin, ymin)
+
+    if isAxisAlignedRectangle(shape) and all(float(v).is_integer() for v in bbox):
+        # The mask would cover the whole ROI: no need to build and apply it.
+        # The encoder needs contiguous data, this is the only case where the ROI is copied.
+        masked_roi = np.ascontiguousarray(roi)
+    else:
+        (height, width) = roi.shape[:2]
+        contours = np.split(np.rint(points).astype(np.int32), contour_ends)
+        if width * height > INPLACE_MASK_MIN_AREA and roi.dtype.kind == 'u':
+            # Huge ROI: save the memory of the mask
+            masked_roi = mask_in_place(roi, contours)
+        else:
+            # Single channel mask, applied to every channel of the ROI by bitwise_and,
+            # which reads the view directly and produces a new contiguous image
+            msk = rasterize_mask(contours, width, height)
+            masked_roi = cv2.bitwise_and(roi, roi, mask=msk)
+
+    # cv2.imshow('masked image', masked_roi)
+    # cv2.waitKey(2000)
+
+    # Encode in memory, the I/O thread only has to write the resulting buffer
+    (ok, buf) = cv2.imencode(img_format_ext, masked_roi, encode_params)
+    if not ok:
+        logger.error("Could not encode image for annotation #%d.", annot_idx)
+    else:
+        write_queue.put((seg_img_fn, buf.tobytes()))
+
+    # Mask file content: one line per contour, written in binary mode as a single buffer
+    msk_content = "\n".join(";".join(["(%0.2f,%0.2f)" % (x, y) for (x, y) in c])
+                             for c in np.split(points, contour_ends))
+    write_queue.put((seg_msk_fn, msk_content))
+    return ok
 
 
 # ==============================================================================
@@ -78,7 +273,9 @@ def main():
         formatter_class=argparse.ArgumentDefaultsHelpFormatter,
         description='Generate segmented images from base image and ground truth segmentation file. '
                     + 'Each segmented image will be generated in (approximately) the same format as the input, '
-                    + 'and will be accompanied by ".msk" file containing mask information.', 
+                    + 'with the same depth and channels (e.g. 16 bits or alpha channel are kept when the output format supports them), '
+                    + 'and will be accompanied by ".msk" file containing mask information. '
+                    + 'EXIF orientation of the input image is applied before extraction.', 
         version=PROG_VERSION)
 
     parser.add_argument('-d', '--debug', 
@@ -101,6 +298,12 @@ def main():
         action=StoreExistingOrCreatableDir,
         help="Path to a directory where segmented images will be exported.")
 
+    parser.add_argument('-j', '--jobs',
+        action=StoreIntZeroPositive,
+        default=1,
+        help="Number of threads used to export annotations. " +
+             "0 means one thread per available CPU.")
+
     args = parser.parse_args()
 
     # -----------------------------------------------------------------------------
@@ -121,57 +324,77 @@ def main():
     available_input_drivers = [plugin_numis.lifInputDriver.lifInputDriver, 
                                plugin_numis.catinfoXMLInputDriver.catinfoXMLInputDriver]
     
-    seg = loadWithAnyDriver(args.seg_file, available_input_drivers)
+    # Filter components based on label if needed, while loading
+    type_whitelist = None
+    if args.type_restriction:
+        type_whitelist = set(args.type_restriction)
+    seg = loadWithAnyDriver(args.seg_file, available_input_drivers, type_whitelist)
+    # Note: `seg` can be empty.
 
     # --------------------------------------------------------------------------
     logger.debug("--- Process started. ---")
 
-    # Filter components based on label if needed
-    if args.type_restriction:
-        seg  = [annot for annot in seg  if annot.type in args.type_restriction]
-    # Note: `seg` can be empty.
-
-    img = cv2.imread(args.base_image)
+    img = load_image(args.base_image)
+    if img is None:
+        logger.error("Cannot decode base image '%s'.", args.base_image)
+        return E_BADIMAGE
+    # The image is shared by all worker threads, which must not modify it
+    img.flags.writeable = False
     img_format_ext = os.path.splitext(args.base_image)[1]
     if img_format_ext == "":
         logger.warning("Cannot detect input image format, will use PNG format.")
         img_format_ext = ".png"
-
-    annot_idx = 0
-    for (shape, atype, attributes) in seg:
-        annot_idx += 1
-        logger.debug("Processing annotation %03d with type %s" % (annot_idx, atype))
-
-        (xmin, xmax, ymin, ymax) = shape.boundingBox()
-
+    encode_params = ENCODE_PARAMS.get(img_format_ext.lower(), [])
+
+    jobs = args.jobs or multiprocessing.cpu_count()
+
+    # File writing is performed by a dedicated thread, so that
+    # processing of next annotations is not blocked by disk writes.
+    # Queue size is bounded to limit memory used by pending files.
+    write_queue = Queue.Queue(maxsize=4 * jobs)
+    failed_files = []
+    writer = threading.Thread(target=write_files, args=(write_queue, failed_files))
+    writer.start()
+
+    # Output directory with a trailing separator, shared by all output paths
+    output_prefix = os.path.join(args.output_dir, "")
+
+    def process(task):
+        (annot_idx, annot) = task
+        return process_annotation(annot_idx, annot, img, output_prefix, img_format_ext, encode_params, write_queue)
+
+    # Annotations with a null area are skipped before dispatch.
+    # Indices are assigned first, so that output filenames do not depend on skipped annotations.
+    tasks = []
+    for (annot_idx, annot) in enumerate(seg, 1):
+        (xmin, xmax, ymin, ymax) = annot.bbox
         if xmin == xmax or ymin == ymax:
-            logger.error("Annotation %03d was skipped because its area is null." % annot_idx)
-            logger.error("\t polygon: %s" % (shape))
-            continue
-
-        filename_base = "%03d-%s" % (annot_idx, gen_filename_base(atype, attributes))
-        seg_img_fn = os.path.join(args.output_dir, "%s%s" % (filename_base, img_format_ext))
-        seg_msk_fn = os.path.join(args.output_dir, "%s%s" % (filename_base, ".msk"))
-
-        roi = img[ymin:ymax, xmin:xmax, :] # TODO test if this works with binary and color images
-
-        shape.shift(-xmin, -ymin)
-
-        msk = np.zeros(roi.shape, dtype=np.uint8)
-        white = (255,255,255) # FIXME will not work for RGBA or single color images
-        # white = (255,) *  roi.shape[-1]
-        cv2.fillPoly(msk, map(lambda c: np.array(c, dtype=np.int32), shape), white)
-        masked_roi = cv2.bitwise_and(roi, msk)
-
-        # cv2.imshow('masked image', masked_roi)
-        # cv2.waitKey(2000)
-
-        cv2.imwrite(seg_img_fn, masked_roi)
-
-        with open(seg_msk_fn, 'w') as msk_file:
-            for c in shape:
-                msk_file.write(";".join(map(lambda p: "(%0.2f,%0.2f)" % p, c)))
-
+            logger.error("Annotation %03d was skipped because its area is null.", annot_idx)
+            logger.error("\t polygon: %s", annot.shape)
+        else:
+            tasks.append((annot_idx, annot))
+
+    # Annotations are independent, and OpenCV releases the GIL: use threads sharing `img`
+    try:
+        if jobs > 1:
+            pool = ThreadPool(jobs)
+            try:
+                encoded = pool.map(process, tasks)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            encoded = [process(task) for task in tasks]
+    finally:
+        write_queue.put(None)
+        writer.join()
+
+    # Errors were reported as they occurred, make sure they are not overlooked
+    encode_failure_count = encoded.count(False)
+    if encode_failure_count > 0 or len(failed_files) > 0:
+        logger.error("%d image(s) could not be encoded and %d file(s) could not be written.",
+                     encode_failure_count, len(failed_files))
+        return E_WRITEERROR
 
 
     logger.debug("--- Process complete. ---")
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for the input drivers, on small inline documents.
+Run from the root of the project with: python -m unittest discover
+"""
+
+# ==============================================================================
+# Imports
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+# ==============================================================================
+# Project imports
+import plugin_numis.lifInputDriver
+from plugin_numis.lifInputDriver import lifInputDriver
+from plugin_numis.catinfoXMLInputDriver import catinfoXMLInputDriver, XMLFileError
+from drivers.InputDriver import (UnsupportedFile, NoInputDriverCompatibleError, SegmentationAnnotation,
+                                 loadWithAnyDriver)
+import Polygon
+
+# ==============================================================================
+
+LIF_DOCUMENT = {
+    "shapes": [
+        {"label": "ca1", "points": [[10, 10], [10, 50], [60, 50], [60, 10]]},
+        {"label": "l2", "points": [[20.5, 15.25], [22.0, 40.0], [45.75, 38.5]]},
+        {"label": "n", "points": [[0, 0], [0, 5], [5, 5], [5, 0]]},
+    ],
+    "imagePath": "image.tif"}
+
+XML_DOCUMENT = """<?xml version="1.0" encoding="utf-8"?>
+<coins>
+    <coin>
+        <image face="avert" x="817" y="180" w="256" h="254" id="9"/>
+        <image face="revert" x="1113" y="175" w="255" h="255" id="6"/>
+        <label x="1071" y="408" w="43" h="25" id="1"/>
+        <comment>Text <b>content</b></comment>
+    </coin>
+    <coin>
+        <image face="isolee" x="10.5" y="20" w="30" h="40.25" id="3"/>
+    </coin>
+</coins>
+"""
+
+
+class DriverTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def writeFile(self, name, content):
+        path = os.path.join(self.tmp_dir, name)
+        with open(path, 'w') as out_file:
+            out_file.write(content)
+        return path
+
+
+class TestLifInputDriver(DriverTestCase):
+    def setUp(self):
+        DriverTestCase.setUp(self)
+        self.path = self.writeFile("annotations.lif", json.dumps(LIF_DOCUMENT))
+
+    def test_load(self):
+        annotations = lifInputDriver.load(self.path)
+        self.assertEqual([(a.type, a.attributes) for a in annotations],
+                         [('coin', {'side': 'avers', 'id': '1'}), ('label', {'id': '2'}), ('noise', {})])
+        self.assertEqual(annotations[0].bbox, (10., 60., 10., 50.))
+        self.assertEqual(annotations[1].shape[0], [(20.5, 15.25), (22.0, 40.0), (45.75, 38.5)])
+
+    def test_type_whitelist(self):
+        annotations = lifInputDriver.load(self.path, type_whitelist=set(['label', 'noise']))
+        self.assertEqual([a.type for a in annotations], ['label', 'noise'])
+
+    def test_incremental_parsing(self):
+        expected = lifInputDriver.load(self.path)
+        stream_min_file_size = plugin_numis.lifInputDriver.STREAM_MIN_FILE_SIZE
+        plugin_numis.lifInputDriver.STREAM_MIN_FILE_SIZE = 0
+        try:
+            annotations = lifInputDriver.load(self.path)
+        finally:
+            plugin_numis.lifInputDriver.STREAM_MIN_FILE_SIZE = stream_min_file_size
+        self.assertEqual([(a.shape[0], a.type, a.attributes, a.bbox) for a in annotations],
+                         [(a.shape[0], a.type, a.attributes, a.bbox) for a in expected])
+
+
+class TestCatinfoXMLInputDriver(DriverTestCase):
+    def setUp(self):
+        DriverTestCase.setUp(self)
+        self.path = self.writeFile("cat_info.xml", XML_DOCUMENT)
+
+    def test_load(self):
+        annotations = catinfoXMLInputDriver.load(self.path)
+        # Unknown tags are ignored, ids are generated for each coin
+        self.assertEqual([(a.type, a.attributes['id']) for a in annotations],
+                         [('coin', '_autogen_0001'), ('coin', '_autogen_0001'),
+                          ('label', '_autogen_0001'), ('coin', '_autogen_0002')])
+        self.assertEqual(annotations[3].attributes['side'], 'isolated')
+        for annot in annotations:
+            self.assertEqual(annot.bbox, annot.shape.boundingBox())
+        self.assertEqual(annotations[3].bbox, (10.5, 40.5, 20., 60.25))
+        self.assertEqual(annotations[3].shape.area(), 30 * 40.25)
+
+    def test_type_whitelist(self):
+        annotations = catinfoXMLInputDriver.load(self.path, type_whitelist=set(['label']))
+        self.assertEqual([(a.type, a.attributes['id']) for a in annotations], [('label', '_autogen_0001')])
+
+    def test_bad_nesting(self):
+        path = self.writeFile("bad_cat_info.xml", "<coins><coin><label x='1' y='1' w='2' h='2'></coin></coins>")
+        self.assertRaises(XMLFileError, catinfoXMLInputDriver.load, path)
+
+    def test_unsupported_file(self):
+        self.assertRaises(UnsupportedFile, catinfoXMLInputDriver.load, os.path.join(self.tmp_dir, "annotations.lif"))
+
+
+class _filenameOnlyDriver(object):
+    """
+    Driver which load function does not accept the `type_whitelist` parameter,
+    and does not provide bounding boxes.
+    """
+    @staticmethod
+    def load(filename):
+        if not filename.endswith(".txt"):
+            raise UnsupportedFile(filename)
+        return [SegmentationAnnotation(Polygon.Polygon([(0, 0), (0, 2), (3, 2), (3, 0)]), 'coin', {}),
+                SegmentationAnnotation(Polygon.Polygon([(1, 1), (1, 5), (4, 1)]), 'label', {})]
+
+
+class TestLoadWithAnyDriver(DriverTestCase):
+    def setUp(self):
+        DriverTestCase.setUp(self)
+        self.lif_path = self.writeFile("annotations.lif", json.dumps(LIF_DOCUMENT))
+        self.drivers = [lifInputDriver, _filenameOnlyDriver]
+
+    def test_first_compatible_driver(self):
+        annotations = loadWithAnyDriver(self.lif_path, self.drivers, set(['coin', 'label']))
+        self.assertEqual([a.type for a in annotations], ['coin', 'label'])
+
+    def test_driver_without_type_whitelist(self):
+        annotations = loadWithAnyDriver("annotations.txt", self.drivers)
+        self.assertEqual([a.type for a in annotations], ['coin', 'label'])
+        annotations = loadWithAnyDriver("annotations.txt", self.drivers, set(['label']))
+        self.assertEqual([(a.type, a.bbox) for a in annotations], [('label', (1., 4., 1., 5.))])
+
+    def test_no_compatible_driver(self):
+        self.assertRaises(NoInputDriverCompatibleError, loadWithAnyDriver, "annotations.csv", self.drivers)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for the shape matching and statistics functions of eval_geom.
+Sparse and vectorized implementations are compared against straightforward
+dense implementations, on random annotations.
+Run from the root of the project with: python -m unittest discover
+"""
+
+# ==============================================================================
+# Imports
+import unittest
+
+import numpy as np
+import scipy.sparse
+import Polygon
+
+# ==============================================================================
+# Project imports
+import eval_geom
+from drivers.InputDriver import SegmentationAnnotation
+
+# ==============================================================================
+
+def _random_annotations(random_state, count, rectangle_ratio=0.5):
+    """
+    Return `count` annotations with random rectangles and convex polygons,
+    with many overlaps.
+    """
+    annotations = []
+    for _ in range(count):
+        (cx, cy) = random_state.uniform(0, 200, 2)
+        if random_state.rand() < rectangle_ratio:
+            (w, h) = random_state.uniform(1, 40, 2)
+            shape = Polygon.Polygon([(cx, cy), (cx, cy+h), (cx+w, cy+h), (cx+w, cy)])
+        else:
+            angles = np.sort(random_state.uniform(0, 2 * np.pi, random_state.randint(3, 12)))
+            radius = random_state.uniform(2, 30)
+            shape = Polygon.Polygon(np.column_stack((cx + radius * np.cos(angles), cy + radius * np.sin(angles))).tolist())
+        annotations.append(SegmentationAnnotation(shape, 'coin', {}, shape.boundingBox()))
+    return annotations
+
+def _dense_weight_mat(ref_data_vect, test_data_vect):
+    return np.array([[(ref.shape & test.shape).area() for test in test_data_vect] for ref in ref_data_vect],
+                    dtype=np.float).reshape((len(ref_data_vect), len(test_data_vect)))
+
+def _dense_link_mat(weight_mat, ref_area_vect, test_area_vect):
+    ref_margin_vect = weight_mat.sum(axis=1)
+    test_margin_vect = weight_mat.sum(axis=0)
+    link_mat = np.zeros(weight_mat.shape, dtype=np.bool)
+    for i in range(weight_mat.shape[0]):
+        for j in range(weight_mat.shape[1]):
+            w = weight_mat[i,j]
+            if w > 0:
+                if w / ref_margin_vect[i] >= eval_geom.thresholdRelative:
+                    link_mat[i,j] = w / ref_area_vect[i] > eval_geom.threshold_ref
+                elif w / test_margin_vect[j] >= eval_geom.thresholdRelative:
+                    link_mat[i,j] = w / test_area_vect[j] > eval_geom.threshold_test
+    return link_mat
+
+def _dense_stats(link_mat):
+    (reflen, testlen) = link_mat.shape
+    row_count = [sum(link_mat[i,j] for j in range(testlen)) for i in range(reflen)]
+    col_count = [sum(link_mat[i,j] for i in range(reflen)) for j in range(testlen)]
+    Tc = sum(1 for i in range(reflen) for j in range(testlen)
+             if link_mat[i,j] and row_count[i] == 1 and col_count[j] == 1)
+    To = sum(c - 1 for c in row_count if c > 1)
+    Tu = sum(c - 1 for c in col_count if c > 1)
+    Co = sum(1 for c in row_count if c > 1)
+    Cu = sum(1 for c in col_count if c > 1)
+    Cm = sum(1 for c in row_count if c == 0)
+    Cf = sum(1 for c in col_count if c == 0)
+    return (Tc, To, Tu, Co, Cu, Cm, Cf)
+
+
+class TestCandidatePairs(unittest.TestCase):
+    def _brute_force_pairs(self, ref_bbox_mat, test_bbox_mat):
+        (rx0, rx1, ry0, ry1) = ref_bbox_mat.T[:,:,None]
+        (tx0, tx1, ty0, ty1) = test_bbox_mat.T[:,None,:]
+        return np.nonzero((rx0 <= tx1) & (tx0 <= rx1) & (ry0 <= ty1) & (ty0 <= ry1))
+
+    def test_against_brute_force(self):
+        random_state = np.random.RandomState(0)
+        for (ref_count, test_count) in [(50, 60), (1, 30), (30, 1)]:
+            ref_bbox_mat = eval_geom.compute_bbox_mat(_random_annotations(random_state, ref_count))
+            test_bbox_mat = eval_geom.compute_bbox_mat(_random_annotations(random_state, test_count))
+            (rows, cols) = eval_geom.compute_candidate_pairs(ref_bbox_mat, test_bbox_mat)
+            (expected_rows, expected_cols) = self._brute_force_pairs(ref_bbox_mat, test_bbox_mat)
+            np.testing.assert_array_equal(rows, expected_rows)
+            np.testing.assert_array_equal(cols, expected_cols)
+
+    def test_touching_boxes_are_candidates(self):
+        ref_bbox_mat = np.array([[0., 10., 0., 10.]])
+        test_bbox_mat = np.array([[10., 20., 0., 10.], [10.5, 20., 0., 10.]])
+        (rows, cols) = eval_geom.compute_candidate_pairs(ref_bbox_mat, test_bbox_mat)
+        np.testing.assert_array_equal(cols, [0])
+
+    def test_empty(self):
+        bbox_mat = eval_geom.compute_bbox_mat(_random_annotations(np.random.RandomState(0), 5))
+        empty_mat = eval_geom.compute_bbox_mat([])
+        for (ref_bbox_mat, test_bbox_mat) in [(bbox_mat, empty_mat), (empty_mat, bbox_mat), (empty_mat, empty_mat)]:
+            (rows, cols) = eval_geom.compute_candidate_pairs(ref_bbox_mat, test_bbox_mat)
+            self.assertEqual((len(rows), len(cols)), (0, 0))
+
+
+class TestRectangleWeights(unittest.TestCase):
+    def test_against_exact_intersection(self):
+        random_state = np.random.RandomState(1)
+        ref_data_vect = _random_annotations(random_state, 40, rectangle_ratio=1.)
+        test_data_vect = _random_annotations(random_state, 40, rectangle_ratio=1.)
+        self.assertTrue(eval_geom.compute_rectangle_vect(ref_data_vect).all())
+        ref_bbox_mat = eval_geom.compute_bbox_mat(ref_data_vect)
+        test_bbox_mat = eval_geom.compute_bbox_mat(test_data_vect)
+        (rows, cols) = eval_geom.compute_candidate_pairs(ref_bbox_mat, test_bbox_mat)
+        weights = eval_geom.compute_rectangle_weights(ref_bbox_mat, test_bbox_mat, rows, cols)
+        expected = [(ref_data_vect[i].shape & test_data_vect[j].shape).area() for (i, j) in zip(rows, cols)]
+        np.testing.assert_allclose(weights, expected, rtol=1e-5, atol=1e-3)
+
+    def test_non_rectangles_are_detected(self):
+        data_vect = [SegmentationAnnotation(Polygon.Polygon([(0, 0), (0, 10), (10, 0)]), 'coin', {}, (0., 10., 0., 10.))]
+        self.assertFalse(eval_geom.compute_rectangle_vect(data_vect)[0])
+
+
+class TestSparseMatching(unittest.TestCase):
+    def setUp(self):
+        random_state = np.random.RandomState(2)
+        self.ref_data_vect = _random_annotations(random_state, 60)
+        self.test_data_vect = _random_annotations(random_state, 70)
+
+    def test_weight_mat_against_dense(self):
+        weight_mat = eval_geom.compute_weight_mat(self.ref_data_vect, self.test_data_vect)
+        expected = _dense_weight_mat(self.ref_data_vect, self.test_data_vect)
+        np.testing.assert_allclose(weight_mat.toarray(), expected, rtol=1e-5, atol=1e-3)
+
+    def test_approximate_methods_are_exact_for_few_vertices(self):
+        # Approximations are slower than exact clipping for such polygons: they are not used
+        expected = eval_geom.compute_weight_mat(self.ref_data_vect, self.test_data_vect)
+        for method in [eval_geom.METHOD_RASTER, eval_geom.METHOD_MONTECARLO]:
+            weight_mat = eval_geom.compute_weight_mat(self.ref_data_vect, self.test_data_vect, method)
+            np.testing.assert_array_equal(weight_mat.toarray(), expected.toarray())
+
+    def test_link_mat_and_stats_against_dense(self):
+        weight_mat = eval_geom.compute_weight_mat(self.ref_data_vect, self.test_data_vect)
+        ref_area_vect = eval_geom.compute_area_vect(self.ref_data_vect)
+        test_area_vect = eval_geom.compute_area_vect(self.test_data_vect)
+        link_mat = eval_geom.compute_link_mat(weight_mat,
+                                              eval_geom.compute_ref_margin_vect(weight_mat),
+                                              eval_geom.compute_test_margin_vect(weight_mat),
+                                              ref_area_vect, test_area_vect)
+        expected_link_mat = _dense_link_mat(weight_mat.toarray(), ref_area_vect, test_area_vect)
+        np.testing.assert_array_equal(link_mat.toarray(), expected_link_mat)
+        self.assertEqual(eval_geom.compute_stats(link_mat), _dense_stats(expected_link_mat))
+
+    def test_stats_against_dense(self):
+        random_state = np.random.RandomState(3)
+        for shape in [(20, 25), (1, 10), (10, 1), (0, 5), (5, 0)]:
+            dense_link_mat = random_state.rand(*shape) < 0.1
+            link_mat = scipy.sparse.csr_matrix(dense_link_mat)
+            self.assertEqual(eval_geom.compute_stats(link_mat), _dense_stats(dense_link_mat))
+
+
+if __name__ == "__main__":
+    unittest.main()
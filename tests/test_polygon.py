@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for utils.polygon.
+Run from the root of the project with: python -m unittest discover
+"""
+
+# ==============================================================================
+# Imports
+import unittest
+
+import numpy as np
+import Polygon
+
+# ==============================================================================
+# Project imports
+from utils.polygon import isSelfIntersecting, pointsInside, rasterIntersectionArea
+
+# ==============================================================================
+
+def _circle(cx, cy, radius, n_points=64):
+    angles = np.linspace(0, 2 * np.pi, n_points, endpoint=False)
+    return Polygon.Polygon(np.column_stack((cx + radius * np.cos(angles), cy + radius * np.sin(angles))).tolist())
+
+
+class TestRasterIntersectionArea(unittest.TestCase):
+    # Stated accuracy for shapes larger than eval_geom.RASTER_MIN_AREA
+    MAX_RELATIVE_ERROR = 0.02
+    MAX_RELATIVE_BIAS = 0.005
+
+    def test_integer_rectangles_are_exact(self):
+        rect1 = Polygon.Polygon([(0, 0), (0, 40), (50, 40), (50, 0)])
+        rect2 = Polygon.Polygon([(10, 5), (10, 60), (70, 60), (70, 5)])
+        self.assertEqual(rasterIntersectionArea(rect1, rect2), (rect1 & rect2).area())
+
+    def test_disjoint_shapes(self):
+        self.assertEqual(rasterIntersectionArea(_circle(0, 0, 20), _circle(100, 100, 20)), 0.0)
+
+    def test_circles_against_exact_area(self):
+        random_state = np.random.RandomState(0)
+        errors = []
+        for _ in range(100):
+            radius = random_state.uniform(20, 60)
+            (cx, cy) = random_state.uniform(100, 110, 2)
+            (dx, dy) = radius * random_state.uniform(-1, 1, 2)
+            circle1 = _circle(cx, cy, radius)
+            circle2 = _circle(cx + dx, cy + dy, radius)
+            exact = (circle1 & circle2).area()
+            errors.append((rasterIntersectionArea(circle1, circle2) - exact) / exact)
+        errors = np.array(errors)
+        self.assertLessEqual(np.abs(errors).max(), self.MAX_RELATIVE_ERROR)
+        self.assertLessEqual(abs(errors.mean()), self.MAX_RELATIVE_BIAS)
+
+
+def _star(vertex_count, swap=None):
+    """
+    Return a simple star-shaped polygon, or a self-intersecting one if two of its
+    vertices are swapped.
+    """
+    random_state = np.random.RandomState(vertex_count)
+    angles = np.linspace(0, 2 * np.pi, vertex_count, endpoint=False)
+    radii = random_state.uniform(50, 100, vertex_count)
+    points = np.column_stack((radii * np.cos(angles), radii * np.sin(angles)))
+    if swap is not None:
+        points[list(swap)] = points[list(swap[::-1])]
+    return Polygon.Polygon(points.tolist())
+
+
+class TestIsSelfIntersecting(unittest.TestCase):
+    def test_small_polygons(self):
+        self.assertFalse(isSelfIntersecting(Polygon.Polygon([(0, 0), (0, 10), (10, 10), (10, 0)])))
+        self.assertTrue(isSelfIntersecting(Polygon.Polygon([(0, 0), (0, 10), (10, 0), (10, 10)])))
+
+    def test_large_polygons(self):
+        # Edges are tested by blocks for such polygons, including the last ones
+        for vertex_count in (20, 700):
+            self.assertFalse(isSelfIntersecting(_star(vertex_count)))
+            self.assertTrue(isSelfIntersecting(_star(vertex_count, swap=(1, 3))))
+            self.assertTrue(isSelfIntersecting(_star(vertex_count, swap=(vertex_count - 4, vertex_count - 2))))
+
+
+class TestPointsInside(unittest.TestCase):
+    @staticmethod
+    def _bruteForce(poly, points):
+        # Even-odd rule, testing every edge against every point
+        (x, y) = (points[:,0], points[:,1])
+        inside = np.zeros(len(points), dtype=np.bool)
+        for c in poly:
+            for ((xa, ya), (xb, yb)) in zip(c, c[1:] + c[:1]):
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    inside ^= ((ya > y) != (yb > y)) & (x < (xb - xa) * (y - ya) / (yb - ya) + xa)
+        return inside
+
+    def test_against_brute_force(self):
+        random_state = np.random.RandomState(0)
+        star = Polygon.Polygon([(50 + r * np.cos(a), 50 + r * np.sin(a))
+                                for (a, r) in zip(np.linspace(0, 2 * np.pi, 40, endpoint=False), [45, 15] * 20)])
+        for poly in (_circle(50, 50, 40), star, Polygon.Polygon([(10, 10), (10, 90), (90, 90), (90, 10)])):
+            points = random_state.uniform(0, 100, (5000, 2)).astype(np.float32)
+            expected = self._bruteForce(poly, points)
+            np.testing.assert_array_equal(pointsInside(poly, points), expected)
+            # pre-sorted points take a different code path
+            order = np.argsort(points[:,1], kind='mergesort')
+            np.testing.assert_array_equal(pointsInside(poly, points[order]), expected[order])
+
+    def test_empty_points(self):
+        self.assertEqual(len(pointsInside(_circle(0, 0, 10), np.zeros((0, 2), dtype=np.float32))), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for the extraction of segmented images by segmenter.
+Outputs are compared against a straightforward implementation, which rasterizes a
+full mask with cv2.fillPoly, on synthetic images.
+Run from the root of the project with: python -m unittest discover
+"""
+
+# ==============================================================================
+# Imports
+import os
+import shutil
+import tempfile
+import unittest
+import Queue
+
+import numpy as np
+import cv2
+import Polygon
+
+# ==============================================================================
+# Project imports
+import segmenter
+from drivers.InputDriver import SegmentationAnnotation
+
+# ==============================================================================
+
+def _random_image(channels, dtype=np.uint8, shape=(120, 160)):
+    random_state = np.random.RandomState(channels)
+    img = random_state.randint(1, np.iinfo(dtype).max, shape + (channels,)).astype(dtype)
+    return img[:,:,0] if channels == 1 else img
+
+def _annotation(points):
+    shape = Polygon.Polygon(points)
+    return SegmentationAnnotation(shape, 'text', {'id' : '1'}, shape.boundingBox())
+
+def _reference_output(annot, img):
+    """
+    Return the expected segmented image and mask file content of `annot`.
+    """
+    (xmin, xmax, ymin, ymax) = annot.bbox
+    roi = img[int(ymin):int(ymax), int(xmin):int(xmax)]
+    contours = [np.asarray(c, dtype=np.float64) - (xmin, ymin) for c in annot.shape]
+    msk = np.zeros(roi.shape[:2], dtype=np.uint8)
+    cv2.fillPoly(msk, [np.rint(c).astype(np.int32) for c in contours], 255)
+    msk_content = "\n".join(";".join("(%0.2f,%0.2f)" % (x, y) for (x, y) in c) for c in contours)
+    return (cv2.bitwise_and(roi, roi, mask=msk), msk_content)
+
+# Annotations with different processing paths
+RECTANGLE = _annotation([(20, 10), (20, 60), (90, 60), (90, 10)])
+FRACTIONAL_RECTANGLE = _annotation([(20.5, 10), (20.5, 60), (90, 60), (90, 10)])
+POLYGON = _annotation([(30, 15), (12, 70), (85, 95), (140, 40), (70, 50)])
+FRACTIONAL_POLYGON = _annotation([(30.4, 15.6), (12.2, 70.5), (85.7, 95.1), (140.3, 40.8)])
+
+
+class TestProcessAnnotation(unittest.TestCase):
+    def process(self, annot, img, img_format_ext=".png"):
+        """
+        Return the decoded segmented image and the mask file content produced for `annot`.
+        """
+        write_queue = Queue.Queue()
+        self.assertTrue(segmenter.process_annotation(1, annot, img, "out/", img_format_ext, [], write_queue))
+        files = dict(write_queue.get_nowait() for _ in range(write_queue.qsize()))
+        self.assertEqual(sorted(files), sorted(["out/001-t1" + img_format_ext, "out/001-t1.msk"]))
+        seg_img = cv2.imdecode(np.frombuffer(files["out/001-t1" + img_format_ext], dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+        return (seg_img, files["out/001-t1.msk"])
+
+    def assertSameOutput(self, annot, img):
+        (seg_img, msk_content) = self.process(annot, img)
+        (expected_img, expected_msk_content) = _reference_output(annot, img)
+        self.assertEqual(seg_img.dtype, expected_img.dtype)
+        np.testing.assert_array_equal(seg_img, expected_img)
+        self.assertEqual(msk_content, expected_msk_content)
+
+    def test_against_reference(self):
+        for channels in (1, 3, 4):
+            img = _random_image(channels)
+            for annot in (RECTANGLE, FRACTIONAL_RECTANGLE, POLYGON, FRACTIONAL_POLYGON):
+                self.assertSameOutput(annot, img)
+
+    def test_rectangle_is_not_masked(self):
+        img = _random_image(3)
+        (seg_img, _) = self.process(RECTANGLE, img)
+        np.testing.assert_array_equal(seg_img, img[10:60, 20:90])
+
+    def test_16_bits_image(self):
+        self.assertSameOutput(POLYGON, _random_image(3, dtype=np.uint16))
+
+    def test_mask_in_place(self):
+        inplace_mask_min_area = segmenter.INPLACE_MASK_MIN_AREA
+        segmenter.INPLACE_MASK_MIN_AREA = 0
+        try:
+            for channels in (1, 3, 4):
+                for dtype in (np.uint8, np.uint16):
+                    img = _random_image(channels, dtype)
+                    for annot in (POLYGON, FRACTIONAL_POLYGON):
+                        self.assertSameOutput(annot, img)
+        finally:
+            segmenter.INPLACE_MASK_MIN_AREA = inplace_mask_min_area
+
+
+class TestWriteFiles(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_failures_are_recorded(self):
+        (ok_path, blocked_path) = (os.path.join(self.tmp_dir, "ok.msk"), os.path.join(self.tmp_dir, "blocked.msk"))
+        os.mkdir(blocked_path)
+        write_queue = Queue.Queue()
+        for item in [(blocked_path, "a"), (ok_path, "b"), None]:
+            write_queue.put(item)
+        failed_files = []
+        segmenter.write_files(write_queue, failed_files)
+        self.assertEqual(failed_files, [blocked_path])
+        with open(ok_path, 'rb') as in_file:
+            self.assertEqual(in_file.read(), "b")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -100,4 +100,4 @@ class Store0to1float(argparse.Action):
 def dumpArgs(args, logger=logger):
     logger.debug("Arguments:")
     for (k, v) in args.__dict__.items():
-        logger.debug("    %-20s = %s" % (k, v))
+        logger.debug("    %-20s = %s", k, v)
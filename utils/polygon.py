@@ -3,8 +3,9 @@
 
 # ==============================================================================
 # Imports
-from collections import namedtuple
+import math
 
+import numpy as np
 import Polygon
 import Polygon.Utils
 import Polygon.IO # dbg
@@ -20,15 +21,6 @@ logger = createAndInitLogger(__name__)
 # poly_regular = Polygon.Polygon([(0,0), (0, 10), (10, 10), (10, 0)])
 # poly_crossed = Polygon.Polygon([(0,0), (0, 10), (10, 0), (10, 10)])
 
-""" Polygon point. """
-PPoint = namedtuple("PPoint", ["x", "y"])
-""" Polygon edge. """
-# start = start PPoint
-# end   = end PPoint
-## cidx  = contour index
-## eidx  = edge index in contour
-PEdge = namedtuple("PEdge", ["start", "end"]) #, "cidx", "eidx"])
-
 def _checkPoly1Contour(poly):
     """
     Check that poly complies with current limitations.
@@ -39,58 +31,82 @@ def _checkPoly1Contour(poly):
     if len(poly) > 1:
         msg = "Error: Current version of eval_seg cannot handle polygons with multiple contours."
         logger.error(msg)
-        logger.error("Poly: %s" % poly)
+        logger.error("Poly: %s", poly)
         raise ValueError(msg)
 
 
 def _polyEdges(poly):
     """
-    Return a list of `PEdge` for the first contour of poly.
+    Return the (starts, ends) arrays of shape (N, 2) describing the edges of the
+    first contour of poly.
     It includes the segment between last point and first point.
     """
     _checkPoly1Contour(poly) # /!\ if accept more than 1 contour, you may have to store contour index
-    edges = []
-    for c in poly:
-        for i in range(len(c)):
-            (x0, y0) = c[i-1]
-            (x1, y1) = c[i]
-            edges.append(PEdge(PPoint(float(x0), float(y0)), PPoint(float(x1), float(y1)))) #, 1, i))
-    return edges
+    if len(poly) == 0:
+        empty = np.empty((0, 2), dtype=np.float64)
+        return (empty, empty)
+    ends = np.asarray(poly[0], dtype=np.float64).reshape((-1, 2))
+    starts = np.roll(ends, 1, axis=0)
+    return (starts, ends)
 
 def _isLeft(P0, P1, P2):
     """
-    Test if point P2 is Left|On|Right of the line P0 to P1.
+    Test if points P2 are Left|On|Right of the lines P0 to P1.
+    Points are given as (x, y) arrays, and are broadcast together.
     returns: >0 for left, 0 for on, and <0 for right of the line.
     """
-    return (P1.x - P0.x)*(P2.y - P0.y) - (P2.x - P0.x)*(P1.y -  P0.y)
+    return (P1[...,0] - P0[...,0])*(P2[...,1] - P0[...,1]) - (P2[...,0] - P0[...,0])*(P1[...,1] -  P0[...,1])
 
-def _intersect(edge1, edge2):
+def _intersect(starts1, ends1, starts2, ends2):
     """
-    Test if two `PEdge`s are intersecting.
-    Warning: calling this function with the same edge twice returns True.
+    Test if the edges (starts1, ends1) intersect the edges (starts2, ends2).
+    Edges are given as (x, y) arrays, and are broadcast together.
+    Return a boolean array.
+    Warning: testing an edge against itself returns True.
     """
     # consecutive edges connexions are not intersections
-    if edge1.end == edge2.start or edge2.end == edge1.start:
-        return False
+    connected = (ends1 == starts2).all(axis=-1) | (ends2 == starts1).all(axis=-1)
 
     # test for existence of an intersect point
-    lsign = rsign = 0.0
-    lsign = _isLeft(edge1.start, edge1.end, edge2.start)  #  edge2 start point sign
-    rsign = _isLeft(edge1.start, edge1.end, edge2.end)    #  edge2 end point sign
-    if (lsign * rsign > 0): # edge2 endpoints have same sign  relative to edge1
-        return False       # => on same side => no intersect is possible
-    lsign = _isLeft(edge2.start, edge2.end, edge1.start)  #  edge1 start point sign
-    rsign = _isLeft(edge2.start, edge2.end, edge1.end)    #  edge1 end point sign
-    if (lsign * rsign > 0): # edge1 endpoints have same sign  relative to edge2
-        return False       # => on same side => no intersect is possible
-    # the segments edge1 and edge2 straddle each other
-    return True            # => an intersect exists
+    # edges2 endpoints have same sign relative to edges1 => on same side => no intersect is possible
+    separated = _isLeft(starts1, ends1, starts2) * _isLeft(starts1, ends1, ends2) > 0
+    # edges1 endpoints have same sign relative to edges2 => on same side => no intersect is possible
+    separated |= _isLeft(starts2, ends2, starts1) * _isLeft(starts2, ends2, ends1) > 0
+    # the segments which are left straddle each other
+    return ~(connected | separated)
+
+def _isLeftScalar(P0, P1, P2):
+    """
+    Same as _isLeft, for single (x, y) points.
+    """
+    return (P1[0] - P0[0])*(P2[1] - P0[1]) - (P2[0] - P0[0])*(P1[1] -  P0[1])
+
+def _intersectScalar(start1, end1, start2, end2):
+    """
+    Same as _intersect, for single edges given as (x, y) tuples.
+    """
+    # consecutive edges connexions are not intersections
+    if end1 == start2 or end2 == start1:
+        return False
+    # test for existence of an intersect point
+    if _isLeftScalar(start1, end1, start2) * _isLeftScalar(start1, end1, end2) > 0:
+        return False
+    if _isLeftScalar(start2, end2, start1) * _isLeftScalar(start2, end2, end1) > 0:
+        return False
+    return True
+
+
+# Polygons with at most this number of edges are tested edge by edge: NumPy calls
+# are slower than plain Python for them (measured crossover)
+_SCALAR_MAX_EDGES = 12
+# Maximum number of edge pairs tested at once
+_MAX_EDGE_PAIRS = 1 << 16
 
 
 def isSelfIntersecting(poly):
     """
     Simple detection of self-intersection.
-    Naive O(n^2) implementation for small, 1 contour polygons.
+    Naive O(n^2) implementation for 1 contour polygons.
     """
     # For possible improvements, see:
     # http://en.wikipedia.org/wiki/Bentley%E2%80%93Ottmann_algorithm
@@ -105,17 +121,124 @@ def isSelfIntersecting(poly):
     _checkPoly1Contour(polyPruned)
 
     # Get edges
-    edges = _polyEdges(polyPruned)
+    (starts, ends) = _polyEdges(polyPruned)
+    edge_count = len(starts)
+
+    # Look for intersections between each edge and all the following ones
+    if edge_count <= _SCALAR_MAX_EDGES:
+        (starts, ends) = (map(tuple, starts.tolist()), map(tuple, ends.tolist()))
+        for i in range(edge_count):
+            for j in range(i+1, edge_count):
+                if _intersectScalar(starts[i], ends[i], starts[j], ends[j]):
+                    return True
+        return False
 
-    # Look for intersections
-    for i in range(len(edges)):
-        e1 = edges[i]
-        for j in range(i+1, len(edges)):
-            e2 = edges[j]
-            if _intersect(e1, e2):
-                # logger.error("Intersection: e1= %s ; e2= %s", e1, e2)
-                return True
+    # Blocks of edges are tested against all edges at once, keeping only the following ones
+    block_size = max(1, _MAX_EDGE_PAIRS // edge_count)
+    for i in range(0, edge_count - 1, block_size):
+        rows = np.arange(i, min(i + block_size, edge_count))
+        following = rows[:,np.newaxis] < np.arange(i, edge_count)
+        if (_intersect(starts[rows,np.newaxis], ends[rows,np.newaxis], starts[i:], ends[i:]) & following).any():
+            # logger.error("Intersection: e1= %s", (starts[rows], ends[rows]))
+            return True
 
     return False
 
 
+def isAxisAlignedRectangle(poly):
+    """
+    Test if poly is made of a single contour which covers exactly its bounding box.
+    """
+    if len(poly) != 1:
+        return False
+    (xmin, xmax, ymin, ymax) = poly.boundingBox()
+    bbox_area = (xmax - xmin) * (ymax - ymin)
+    return abs(poly.area() - bbox_area) <= 1e-9 * bbox_area
+
+
+def _rowCrossings(poly, xmin, ymin, width, height):
+    """
+    Return the crossings of the edges of poly with the horizontal lines going through
+    pixel centers, in a window of size (height, width) which top left corner is at
+    (xmin, ymin) in polygon coordinates.
+    Each crossing is given as a flat index r * (width + 1) + k, where r is the row and
+    k the first pixel of the row which center is on the right of the crossing.
+    """
+    indices = []
+    for c in poly:
+        (xa, ya) = (np.asarray(c, dtype=np.float64) - (xmin, ymin)).T
+        (xb, yb) = (np.roll(xa, -1), np.roll(ya, -1))
+        # Edge e crosses the centers of rows r such that min(ya, yb) <= r + 0.5 < max(ya, yb)
+        # (horizontal edges do not cross any row)
+        row_start = np.clip(np.ceil(np.minimum(ya, yb) - 0.5), 0, height).astype(np.intp)
+        row_stop = np.clip(np.ceil(np.maximum(ya, yb) - 0.5), 0, height).astype(np.intp)
+        row_count = row_stop - row_start
+        e = np.repeat(np.arange(len(xa)), row_count)
+        r = row_start[e] + np.arange(len(e)) - np.repeat(np.cumsum(row_count) - row_count, row_count)
+        x = xa[e] + (r + 0.5 - ya[e]) * (xb[e] - xa[e]) / (yb[e] - ya[e])
+        k = np.clip(np.floor(x - 0.5) + 1, 0, width).astype(np.intp)
+        indices.append(r * (width + 1) + k)
+    return np.concatenate(indices) if indices else np.zeros(0, dtype=np.intp)
+
+
+def rasterIntersectionArea(poly1, poly2):
+    """
+    Approximate the area of the intersection of two polygons by rasterizing them
+    over the intersection of their bounding boxes and counting pixels which centers
+    are inside both of them (even-odd rule): unlike filling boundary pixels, this
+    does not bias the estimation.
+    Precision is limited to the pixel. The cost grows with the area of the window rather
+    than with the number of vertices: this is only faster than exact clipping for polygons
+    with thousands of vertices over a window of moderate size.
+    """
+    (xmin1, xmax1, ymin1, ymax1) = poly1.boundingBox()
+    (xmin2, xmax2, ymin2, ymax2) = poly2.boundingBox()
+    xmin = int(math.floor(max(xmin1, xmin2)))
+    xmax = int(math.ceil(min(xmax1, xmax2)))
+    ymin = int(math.floor(max(ymin1, ymin2)))
+    ymax = int(math.ceil(min(ymax1, ymax2)))
+    if xmin >= xmax or ymin >= ymax:
+        return 0.0
+    (width, height) = (xmax - xmin, ymax - ymin)
+    # Each crossing toggles the inside state of the following pixels of the row:
+    # bit 0 for poly1, bit 1 for poly2.
+    toggles = np.zeros(height * (width + 1), dtype=np.uint8)
+    np.bitwise_xor.at(toggles, _rowCrossings(poly1, xmin, ymin, width, height), 1)
+    np.bitwise_xor.at(toggles, _rowCrossings(poly2, xmin, ymin, width, height), 2)
+    inside = np.bitwise_xor.accumulate(toggles.reshape((height, width + 1))[:, :width], axis=1)
+    return float(np.count_nonzero(inside == 3))
+
+
+def pointsInside(poly, points):
+    """
+    Vectorized even-odd test of the inclusion of points in poly.
+    `points` is a (K, 2) array; return a (K,) boolean array.
+    Points are processed by increasing y coordinate, so that each edge is only tested
+    against the points in its vertical range, for all edges at once: sorting points
+    by y beforehand saves a sort.
+    """
+    y = points[:,1]
+    if len(y) > 1 and (y[1:] < y[:-1]).any():
+        order = np.argsort(y, kind='mergesort')
+        inside = np.empty(len(points), dtype=np.bool)
+        inside[order] = pointsInside(poly, points[order])
+        return inside
+    x = points[:,0]
+    crossing_counts = np.zeros(len(points), dtype=np.intp)
+    for c in poly:
+        (xa, ya) = np.asarray(c, dtype=np.float64).T
+        (xb, yb) = (np.roll(xa, -1), np.roll(ya, -1))
+        # Edge e crosses the horizontal lines of points such that min(ya, yb) <= y < max(ya, yb)
+        # (horizontal edges do not cross any line)
+        starts = np.searchsorted(y, np.minimum(ya, yb).astype(y.dtype), side='left')
+        stops = np.searchsorted(y, np.maximum(ya, yb).astype(y.dtype), side='left')
+        # All (edge, point) pairs at once: few edges cross the line of each point
+        point_count = stops - starts
+        e = np.repeat(np.arange(len(xa)), point_count)
+        p = starts[e] + np.arange(len(e)) - np.repeat(np.cumsum(point_count) - point_count, point_count)
+        # Edge coordinates are converted to the type of points before computing the crossings
+        (dx, dy) = ((xb - xa).astype(y.dtype), (yb - ya).astype(y.dtype))
+        (xa, ya) = (xa.astype(y.dtype), ya.astype(y.dtype))
+        crossing = x[p] < dx[e] * (y[p] - ya[e]) / dy[e] + xa[e]
+        crossing_counts += np.bincount(p[crossing], minlength=len(points))
+    return crossing_counts % 2 == 1